@@ -1,9 +1,10 @@
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Request, WebSocket
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from beanie import init_beanie
 from motor.motor_asyncio import AsyncIOMotorClient
+from typing import Optional
 import os
 from dotenv import load_dotenv
 
@@ -12,6 +13,7 @@ load_dotenv()
 
 from app.models.instance import AgentInstance
 from app.models.memory import AgentMemory
+from app.models.analytics import InstanceDailyStats, InstanceDailySession
 from app.routes.agent import router as agent_router
 
 app = FastAPI(
@@ -57,7 +59,7 @@ async def startup_event():
     # Inicializa Beanie
     await init_beanie(
         database=database,
-        document_models=[AgentInstance, AgentMemory]
+        document_models=[AgentInstance, AgentMemory, InstanceDailyStats, InstanceDailySession]
     )
 
 
@@ -70,34 +72,14 @@ async def get_playground(request: Request):
     """Serve a página do playground de testes."""
     return templates.TemplateResponse("playground.html", {"request": request})
 
-from app.services.agent_manager import agent_manager
+from app.services.chat_connection import ChatConnection
+from app.services.run_control import run_metrics
 
 @app.websocket("/ws/chat")
-async def websocket_endpoint(websocket: WebSocket, user_id: str, instance_id: str):
+async def websocket_endpoint(websocket: WebSocket, user_id: Optional[str] = None, instance_id: Optional[str] = None):
+    """Chat multiplexado: cada quadro JSON carrega sua própria sessão e id de correlação."""
     await websocket.accept()
-    try:
-        team = await agent_manager.get_or_create_team(user_id, instance_id)
-        team.session_id = f"{user_id}-{instance_id}-playground"
-
-        if not team.members:
-            await websocket.send_text(
-                "A equipe de agentes ainda não foi configurada. "
-                "Por favor, use o painel de configuração para definir os agentes e, "
-                "em seguida, clique em 'Criar/Atualizar Equipe'."
-            )
-            await websocket.close()
-            return
-
-        while True:
-            data = await websocket.receive_text()
-            response = team.run(data)
-            await websocket.send_text(response.content)
-            
-    except WebSocketDisconnect:
-        print(f"Cliente desconectado: {user_id}-{instance_id}")
-    except Exception as e:
-        await websocket.send_text(f"Ocorreu um erro: {e}")
-        await websocket.close()
+    await ChatConnection(websocket, user_id, instance_id).serve()
 
 # Inclui as rotas
 app.include_router(agent_router)
@@ -270,6 +252,11 @@ curl "/agent/sessions/whatsapp:+123.../conversation"</code></pre>
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def metrics():
+    """Contadores de execuções: concluídas, com falha e canceladas por motivo."""
+    return {"runs": run_metrics.snapshot()}
+
 if __name__ == "__main__":
     import uvicorn
     
@@ -1,15 +1,133 @@
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
-from .instance import ModelProvider, ToolConfig
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import Optional, List, Dict, Any, Literal, Union
+from typing_extensions import Annotated
+import hashlib
+import json
+from .instance import ModelProvider, ToolConfig, ToolType, HierarchicalAgentConfig
+
+
+class DuckDuckGoToolParams(BaseModel):
+    """Parâmetros aceitos pela ferramenta DuckDuckGo."""
+    model_config = ConfigDict(extra="forbid", strict=True)
+
+    search: Optional[bool] = None
+    news: Optional[bool] = None
+    fixed_max_results: Optional[int] = None
+    timeout: Optional[int] = None
+    verify_ssl: Optional[bool] = None
+    modifier: Optional[str] = None
+
+
+class YFinanceToolParams(BaseModel):
+    """Parâmetros aceitos pela ferramenta YFinance."""
+    model_config = ConfigDict(extra="forbid", strict=True)
+
+    stock_price: Optional[bool] = None
+    company_info: Optional[bool] = None
+    stock_fundamentals: Optional[bool] = None
+    income_statements: Optional[bool] = None
+    key_financial_ratios: Optional[bool] = None
+    analyst_recommendations: Optional[bool] = None
+    company_news: Optional[bool] = None
+    technical_indicators: Optional[bool] = None
+    historical_prices: Optional[bool] = None
+    enable_all: Optional[bool] = None
+
+
+class DuckDuckGoToolRequest(BaseModel):
+    type: Literal[ToolType.DUCKDUCKGO]
+    config: Optional[DuckDuckGoToolParams] = None
+
+
+class YFinanceToolRequest(BaseModel):
+    type: Literal[ToolType.YFINANCE]
+    config: Optional[YFinanceToolParams] = None
+
+
+# Union discriminada pelo campo "type": um tipo desconhecido gera erro de
+# validação imediato em vez de ser descartado silenciosamente.
+ToolRequest = Annotated[
+    Union[DuckDuckGoToolRequest, YFinanceToolRequest],
+    Field(discriminator="type")
+]
+
 
 class AgentConfigRequest(BaseModel):
     """Configuração para um agente individual dentro de uma hierarquia."""
+    model_config = ConfigDict(extra="forbid", protected_namespaces=())
+
+    agent_id: Optional[str] = None
     name: str
     role: str
-    
+
     model_provider: ModelProvider = ModelProvider.GEMINI
     model_id: str = "gemini-1.5-flash"
-    
-    tools: List[ToolConfig] = []
-    
+
+    tools: List[ToolRequest] = []
+
     parent_id: Optional[str] = None
+
+    @field_validator("model_provider", mode="before")
+    @classmethod
+    def _lower_provider(cls, value: Any) -> Any:
+        # Aceita "GEMINI", "Gemini", etc.
+        return value.lower() if isinstance(value, str) else value
+
+    @field_validator("model_id", mode="before")
+    @classmethod
+    def _default_model_id(cls, value: Any) -> Any:
+        return value or "gemini-1.5-flash"
+
+    @field_validator("tools", mode="before")
+    @classmethod
+    def _expand_tools(cls, value: Any) -> Any:
+        # Aceita a forma curta "YFINANCE" e tipos em qualquer caixa.
+        if not isinstance(value, list):
+            return value
+        tools = []
+        for tool in value:
+            if isinstance(tool, str):
+                tool = {"type": tool}
+            if isinstance(tool, dict) and isinstance(tool.get("type"), str):
+                tool = {**tool, "type": tool["type"].upper()}
+            tools.append(tool)
+        return tools
+
+    def to_config(self) -> HierarchicalAgentConfig:
+        """Converte para o modelo persistido sem revalidar os dados."""
+        tools = [
+            ToolConfig.model_construct(
+                type=tool.type,
+                config=tool.config.model_dump(exclude_none=True) if tool.config else None
+            )
+            for tool in self.tools
+        ]
+        fields: Dict[str, Any] = dict(
+            name=self.name,
+            role=self.role,
+            model_provider=self.model_provider,
+            model_id=self.model_id,
+            tools=tools,
+            parent_id=self.parent_id
+        )
+        # Sem agent_id explícito o default gera um UUID e o campo fica fora de
+        # model_fields_set, o que permite herdar o id do agente existente.
+        if self.agent_id:
+            fields["agent_id"] = self.agent_id
+        return HierarchicalAgentConfig.model_construct(**fields)
+
+
+def compute_config_hash(
+    router_instructions: Optional[str],
+    agents: Optional[List[AgentConfigRequest]]
+) -> str:
+    """Gera um hash estável do conteúdo de uma atualização de hierarquia."""
+    payload: Dict[str, Any] = {
+        "router_instructions": router_instructions,
+        "agents": (
+            [a.model_dump(mode="json", exclude_none=True) for a in agents]
+            if agents is not None else None
+        )
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
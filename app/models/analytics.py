@@ -0,0 +1,59 @@
+from beanie import Document
+from pydantic import Field
+from datetime import datetime
+import pymongo
+from pymongo import IndexModel
+
+class InstanceDailyStats(Document):
+    """Contadores agregados por instância e por dia (UTC), atualizados a cada chat."""
+    user_id: str
+    instance_id: str
+    # Início do dia (00:00 UTC) ao qual o documento se refere
+    day: datetime
+
+    message_count: int = 0
+    # Sessões distintas com mensagens neste dia (ver InstanceDailySession)
+    active_sessions: int = 0
+
+    input_tokens: int = 0
+    output_tokens: int = 0
+    total_tokens: int = 0
+
+    # Soma das latências; a média é latency_ms_total / message_count
+    latency_ms_total: float = 0.0
+
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+    class Settings:
+        name = "instance_daily_stats"
+        indexes = [
+            IndexModel(
+                [("user_id", pymongo.ASCENDING), ("instance_id", pymongo.ASCENDING), ("day", pymongo.ASCENDING)],
+                unique=True
+            ),
+            IndexModel(
+                [("user_id", pymongo.ASCENDING), ("day", pymongo.ASCENDING)]
+            )
+        ]
+
+
+class InstanceDailySession(Document):
+    """Marca que uma sessão já foi contada em active_sessions naquele dia.
+
+    Guarda apenas o hash do session_id (número de WhatsApp) e expira após
+    alguns dias, quando o dia correspondente já está fechado.
+    """
+    user_id: str
+    instance_id: str
+    day: datetime
+    session_hash: str
+
+    class Settings:
+        name = "instance_daily_sessions"
+        indexes = [
+            IndexModel(
+                [("user_id", pymongo.ASCENDING), ("instance_id", pymongo.ASCENDING), ("day", pymongo.ASCENDING), ("session_hash", pymongo.ASCENDING)],
+                unique=True
+            ),
+            IndexModel([("day", pymongo.ASCENDING)], expireAfterSeconds=2 * 24 * 60 * 60)
+        ]
@@ -0,0 +1,22 @@
+from pydantic import BaseModel, Field
+from typing import Optional, Literal
+
+
+class ChatFrame(BaseModel):
+    """Quadro JSON enviado pelo cliente no WebSocket /ws/chat.
+
+    - message: executa `message` na sessão `session_id`; `id` é ecoado na resposta.
+    - cancel: cancela a execução em andamento identificada por `id`.
+    - ping / pong: heartbeat em qualquer direção.
+    """
+    type: Literal["message", "cancel", "ping", "pong"]
+    id: Optional[str] = None
+
+    session_id: Optional[str] = None
+    message: Optional[str] = None
+    # Prazo em segundos para a execução desta mensagem
+    timeout: Optional[float] = Field(None, gt=0)
+
+    # Se omitidos, valem os da query string da conexão
+    user_id: Optional[str] = None
+    instance_id: Optional[str] = None
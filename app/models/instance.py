@@ -80,6 +80,9 @@ class AgentInstance(Document):
     )
     
     agents: List[HierarchicalAgentConfig] = []
+
+    # Hash do conteúdo da última atualização de hierarquia aplicada
+    config_hash: Optional[str] = None
     
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -1,11 +1,13 @@
-from fastapi import APIRouter, HTTPException, Query
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Query, Request, Header
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from app.services.agent_manager import agent_manager
-from app.models.instance import HierarchicalAgentConfig, ModelProvider, ToolConfig, ToolType
+from app.services.run_control import run_team, RunCancelled
+from app.services.analytics import schedule_record_chat, get_instance_stats
+from app.models.agents_request import AgentConfigRequest, compute_config_hash
 from app.models.memory import AgentMemory
-import uuid
 import logging
+import time
 
 router = APIRouter(prefix="/agent", tags=["agent"])
 
@@ -19,6 +21,8 @@ class ChatRequest(BaseModel):
     username: str
     message: str
     session_id: Optional[str] = None
+    # Prazo em segundos para a resposta; tem precedência sobre o header X-Request-Timeout
+    timeout: Optional[float] = Field(None, gt=0)
 
 class ChatResponse(BaseModel):
     response: str
@@ -26,29 +30,52 @@ class ChatResponse(BaseModel):
     success: bool
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat_with_agent(request: ChatRequest):
+async def chat_with_agent(
+    request: ChatRequest,
+    http_request: Request,
+    x_request_timeout: Optional[float] = Header(None, gt=0)
+):
     """Endpoint principal para conversar com a equipe de agentes."""
     try:
-        team = await agent_manager.get_or_create_team(
+        team = await agent_manager.get_session_team(
             user_id=request.user_id,
-            instance_id=request.instance_id
+            instance_id=request.instance_id,
+            session_id=request.whatsapp_number
         )
         
-        team.session_id = request.whatsapp_number
-        
         # Adiciona o nome de usuário à mensagem para o agente
         message_with_context = (
             f"O nome do cliente é {request.username}. "
             f"Mensagem do cliente: {request.message}"
         )
         
-        response = team.run(message_with_context)
+        started = time.monotonic()
+        response = await run_team(
+            team,
+            message_with_context,
+            session_id=request.whatsapp_number,
+            lock=agent_manager.session_lock(request.user_id, request.instance_id, request.whatsapp_number),
+            timeout=request.timeout or x_request_timeout,
+            is_disconnected=http_request.is_disconnected
+        )
+        schedule_record_chat(
+            request.user_id,
+            request.instance_id,
+            request.whatsapp_number,
+            response,
+            (time.monotonic() - started) * 1000
+        )
         
         return ChatResponse(
             response=response.content,
-            session_id=team.session_id,
+            session_id=request.whatsapp_number,
             success=True
         )
+    except RunCancelled as e:
+        if e.reason == "deadline":
+            raise HTTPException(status_code=504, detail="Tempo limite da requisição excedido")
+        # Cliente desconectado: ninguém vai ler a resposta
+        raise HTTPException(status_code=499, detail="Cliente desconectado")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -56,67 +83,18 @@ class HierarchyUpdateRequest(BaseModel):
     user_id: str
     instance_id: str
     router_instructions: Optional[str] = None
-    agents: Optional[List[dict]] = None  # agora aceita dict cru, não só HierarchicalAgentConfig
-
-def normalize_agent(agent_data: dict) -> dict:
-    """Normaliza e valida dados de um agente antes de criar HierarchicalAgentConfig."""
-    # Garante agent_id
-    if not agent_data.get("agent_id"):
-        agent_data["agent_id"] = str(uuid.uuid4())
-
-    # Normaliza provider
-    provider = agent_data.get("model_provider", "gemini")
-    if isinstance(provider, str):
-        provider = provider.lower()
-        try:
-            agent_data["model_provider"] = ModelProvider(provider)
-        except ValueError:
-            agent_data["model_provider"] = ModelProvider.gemini
-    elif isinstance(provider, ModelProvider):
-        agent_data["model_provider"] = provider
-    else:
-        agent_data["model_provider"] = ModelProvider.gemini
-
-    # Model ID default
-    if not agent_data.get("model_id"):
-        agent_data["model_id"] = "gemini-1.5-flash"
-
-    # Normaliza tools
-    tools = agent_data.get("tools", [])
-    normalized_tools = []
-    for t in tools:
-        if isinstance(t, str):
-            try:
-                # Ex: "YFINANCE" → ToolConfig(type=ToolType.YFINANCE)
-                normalized_tools.append(ToolConfig(type=ToolType[t.upper()]))
-            except KeyError:
-                logger.warning(f"Tool '{t}' not found in ToolType enum. Skipping.")
-        elif isinstance(t, dict):
-            # Garante que o type está correto
-            t_type = t.get("type")
-            if isinstance(t_type, str):
-                try:
-                    t["type"] = ToolType[t_type.upper()]
-                    normalized_tools.append(ToolConfig(**t))
-                except KeyError:
-                    logger.warning(f"Tool type '{t_type}' not found in ToolType enum. Skipping tool.")
-            elif isinstance(t_type, ToolType):
-                normalized_tools.append(ToolConfig(**t))
-        elif isinstance(t, ToolConfig):
-            normalized_tools.append(t)
-    agent_data["tools"] = normalized_tools
-
-    return agent_data
+    agents: Optional[List[AgentConfigRequest]] = None
 
 @router.put("/hierarchy")
 async def update_agent_hierarchy(request: HierarchyUpdateRequest):
     logger.info(f"Recebida requisição para /hierarchy: user_id={request.user_id}, instance_id={request.instance_id}")
-    logger.info(f"Payload recebido: {request.dict()}")
 
     try:
+        config_hash = compute_config_hash(request.router_instructions, request.agents)
+
         agents_normalized = None
         if request.agents:
-            agents_normalized = [HierarchicalAgentConfig(**normalize_agent(a)) for a in request.agents]
+            agents_normalized = [a.to_config() for a in request.agents]
 
         hierarchy_updates = {
             "router_instructions": request.router_instructions,
@@ -126,7 +104,8 @@ async def update_agent_hierarchy(request: HierarchyUpdateRequest):
         success = await agent_manager.update_instance_hierarchy(
             user_id=request.user_id,
             instance_id=request.instance_id,
-            hierarchy_updates=hierarchy_updates
+            hierarchy_updates=hierarchy_updates,
+            config_hash=config_hash
         )
 
         if not success:
@@ -136,6 +115,8 @@ async def update_agent_hierarchy(request: HierarchyUpdateRequest):
         logger.info("Hierarquia atualizada com sucesso.")
         return {"message": "Hierarchy configuration updated successfully"}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("Erro ao processar a atualização da hierarquia")
         raise HTTPException(status_code=500, detail=str(e))
@@ -147,6 +128,16 @@ async def get_user_instances(user_id: str):
     instances = await AgentInstance.find(AgentInstance.user_id == user_id).to_list()
     return {"instances": instances}
 
+@router.get("/instances/{user_id}/stats")
+async def get_user_instance_stats(
+    user_id: str,
+    instance_id: Optional[str] = Query(None, description="ID da instância para filtrar as estatísticas"),
+    days: int = Query(7, ge=1, le=90, description="Quantidade de dias (incluindo hoje)")
+):
+    """Estatísticas diárias por instância: mensagens, sessões ativas, tokens e latência média."""
+    stats = await get_instance_stats(user_id, instance_id=instance_id, days=days)
+    return {"stats": stats}
+
 @router.get("/sessions")
 async def get_sessions(
     instance_id: str = Query(..., description="ID da instância para filtrar as sessões"),
@@ -7,15 +7,31 @@ from agno.models.groq import Groq
 from agno.tools.duckduckgo import DuckDuckGoTools
 from agno.tools.yfinance import YFinanceTools
 from agno.storage.mongodb import MongoDbStorage
-from typing import Dict, Optional, List, Any
+from typing import Dict, Optional, List, Any, Tuple, AsyncIterator
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import asyncio
+import copy
+import hashlib
+import json
 import os
 from app.models.instance import AgentInstance, ModelProvider, HierarchicalAgentConfig, ToolConfig, ToolType
 
 from pymongo import uri_parser
 
+SESSION_TEAMS_CACHE_SIZE = int(os.getenv("SESSION_TEAMS_CACHE_SIZE", 256))
+
 class AgentManager:
     def __init__(self):
         self.teams_cache: Dict[str, Team] = {}
+        # O Team do agno guarda o estado da execução no próprio objeto
+        # (session_id, run_id, run_response), então cada sessão ativa roda na
+        # sua própria cópia da equipe da instância, em um LRU limitado.
+        self.session_teams: "OrderedDict[Tuple[str, str], Team]" = OrderedDict()
+        # (cache_key, session_id) -> [lock, usuários]; removido quando livre
+        self.session_locks: Dict[Tuple[str, str], List[Any]] = {}
+        # cache_key -> {agent_id: (fingerprint, config, Agent)}
+        self.members_cache: Dict[str, Dict[str, Tuple[str, HierarchicalAgentConfig, Agent]]] = {}
         self.mongodb_url = os.getenv("MONGODB_URL")
         
         db_name = None
@@ -31,6 +47,20 @@ class AgentManager:
     def _get_cache_key(self, user_id: str, instance_id: str) -> str:
         return f"{user_id}:{instance_id}"
 
+    @asynccontextmanager
+    async def session_lock(self, user_id: str, instance_id: str, session_id: str) -> AsyncIterator[None]:
+        """Serializa as execuções de uma mesma sessão, na ordem de chegada."""
+        key = (self._get_cache_key(user_id, instance_id), session_id)
+        entry = self.session_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.session_locks[key]
+
     def _create_model(self, provider: ModelProvider, model_id: str):
         if provider == ModelProvider.OPENAI:
             return OpenAIChat(id=model_id)
@@ -60,6 +90,103 @@ class AgentManager:
             # Adicione lógica para outras ferramentas aqui
         return tools
 
+    def _agent_fingerprint(self, agent_config: HierarchicalAgentConfig) -> str:
+        """Identifica o conteúdo de um agente, ignorando o agent_id."""
+        data = agent_config.model_dump(mode="json", exclude={"agent_id"})
+        encoded = json.dumps(data, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def _create_member(self, agent_config: HierarchicalAgentConfig, model: Any = None) -> Agent:
+        if model is None:
+            model = self._create_model(agent_config.model_provider, agent_config.model_id)
+        return Agent(
+            name=agent_config.name,
+            role=agent_config.role,
+            model=model,
+            tools=self._create_tools(agent_config.tools),
+            add_datetime_to_instructions=True,
+            markdown=True,
+            show_tool_calls=True
+        )
+
+    def _build_team(
+        self,
+        instance: AgentInstance,
+        previous_team: Optional[Team] = None,
+        previous_members: Optional[Dict[str, Tuple[str, HierarchicalAgentConfig, Agent]]] = None
+    ) -> Team:
+        """Monta a equipe reaproveitando membros, modelos e storage inalterados."""
+        cache_key = self._get_cache_key(instance.user_id, instance.instance_id)
+        previous_members = previous_members or {}
+
+        members = []
+        members_index: Dict[str, Tuple[str, HierarchicalAgentConfig, Agent]] = {}
+        for agent_config in instance.agents:
+            fingerprint = self._agent_fingerprint(agent_config)
+            previous = previous_members.get(agent_config.agent_id)
+
+            if previous and previous[0] == fingerprint:
+                agent = previous[2]
+            elif (
+                previous
+                and previous[1].model_provider == agent_config.model_provider
+                and previous[1].model_id == agent_config.model_id
+            ):
+                # Só mudaram nome, papel ou ferramentas: mantém o cliente do modelo
+                agent = self._create_member(agent_config, model=previous[2].model)
+            else:
+                agent = self._create_member(agent_config)
+
+            members.append(agent)
+            members_index[agent_config.agent_id] = (fingerprint, agent_config, agent)
+
+        if previous_team is not None:
+            storage = previous_team.storage
+            coordinator_model = previous_team.model
+        else:
+            storage = MongoDbStorage(
+                collection_name=f"team_sessions_{instance.user_id}_{instance.instance_id}",
+                db_url=self.mongodb_url,
+                db_name=self.mongodb_database
+            )
+            coordinator_model = Gemini(id="gemini-1.5-flash")
+
+        team = Team(
+            name=f"Team_{instance.instance_id}",
+            members=members,
+            mode="coordinate",
+            model=coordinator_model,
+            storage=storage,
+            instructions=instance.router_instructions,
+            add_history_to_messages=True
+        )
+
+        # Atribuições simples de dicionário: execuções em andamento mantêm a
+        # referência à equipe antiga, e as próximas já recebem a nova.
+        self.members_cache[cache_key] = members_index
+        self.teams_cache[cache_key] = team
+
+        # Cópias por sessão da equipe antiga passam a ser montadas da nova
+        for key in [k for k in self.session_teams if k[0] == cache_key]:
+            del self.session_teams[key]
+        return team
+
+    def _carry_over_agent_ids(
+        self,
+        old_agents: List[HierarchicalAgentConfig],
+        new_agents: List[HierarchicalAgentConfig]
+    ) -> None:
+        """Mantém o agent_id de agentes reenviados sem id, casando pelo nome.
+
+        Só são reescritos os agentes cujo id foi gerado na conversão; um
+        agent_id enviado pelo cliente é sempre respeitado.
+        """
+        new_ids = {a.agent_id for a in new_agents}
+        unclaimed = {a.name: a.agent_id for a in old_agents if a.agent_id not in new_ids}
+        for agent_config in new_agents:
+            if "agent_id" not in agent_config.model_fields_set and agent_config.name in unclaimed:
+                agent_config.agent_id = unclaimed.pop(agent_config.name)
+
     async def get_or_create_team(self, user_id: str, instance_id: str) -> Team:
         cache_key = self._get_cache_key(user_id, instance_id)
         if cache_key in self.teams_cache:
@@ -74,51 +201,53 @@ class AgentManager:
             instance = AgentInstance(user_id=user_id, instance_id=instance_id)
             await instance.save()
 
-        members = []
-        for agent_config in instance.agents:
-            model = self._create_model(agent_config.model_provider, agent_config.model_id)
-            tools = self._create_tools(agent_config.tools)
-            agent = Agent(
-                name=agent_config.name,
-                role=agent_config.role,
-                model=model,
-                tools=tools,
-                add_datetime_to_instructions=True,
-                markdown=True,
-                show_tool_calls=True
-            )
-            members.append(agent)
+        return self._build_team(instance)
 
-        storage = MongoDbStorage(
-            collection_name=f"team_sessions_{user_id}_{instance_id}",
-            db_url=self.mongodb_url,
-            db_name=self.mongodb_database
-        )
+    async def get_session_team(self, user_id: str, instance_id: str, session_id: str) -> Team:
+        """Equipe exclusiva da sessão, copiada da equipe da instância.
+
+        Os membros são copiados com Agent.deep_copy(); storage e cliente do
+        modelo coordenador são reaproveitados da equipe da instância.
+        """
+        template = await self.get_or_create_team(user_id, instance_id)
+        key = (self._get_cache_key(user_id, instance_id), session_id)
+
+        team = self.session_teams.get(key)
+        if team is not None:
+            self.session_teams.move_to_end(key)
+            return team
 
         team = Team(
-            name=f"Team_{instance_id}",
-            members=members,
+            name=template.name,
+            members=[member.deep_copy() for member in template.members],
             mode="coordinate",
-            model=Gemini(id="gemini-1.5-flash"),
-            storage=storage,
-            instructions=instance.router_instructions,
-            add_history_to_messages=True
+            model=copy.copy(template.model),
+            storage=template.storage,
+            instructions=template.instructions,
+            add_history_to_messages=True,
+            session_id=session_id
         )
-
-        self.teams_cache[cache_key] = team
+        self.session_teams[key] = team
+        if len(self.session_teams) > SESSION_TEAMS_CACHE_SIZE:
+            self.session_teams.popitem(last=False)
         return team
 
     async def update_instance_hierarchy(
         self, 
         user_id: str, 
         instance_id: str, 
-        hierarchy_updates: dict
+        hierarchy_updates: dict,
+        config_hash: Optional[str] = None
     ) -> bool:
         instance = await AgentInstance.find_one(
             AgentInstance.user_id == user_id,
             AgentInstance.instance_id == instance_id
         )
 
+        # Reenvio de uma configuração idêntica: nada a salvar nem a invalidar
+        if instance and config_hash and instance.config_hash == config_hash:
+            return True
+
         if not instance:
             new_instance_data = {
                 'user_id': user_id,
@@ -131,18 +260,26 @@ class AgentManager:
             update_data = hierarchy_updates.copy()
             if "agents" in update_data and update_data["agents"] is not None:
                 # A lista já contém objetos HierarchicalAgentConfig
+                self._carry_over_agent_ids(instance.agents, update_data["agents"])
                 instance.agents = update_data["agents"]
                 del update_data["agents"] # Remove para o loop abaixo
 
             for key, value in update_data.items():
                 if hasattr(instance, key) and value is not None:
                     setattr(instance, key, value)
-        
+
+        instance.config_hash = config_hash
         await instance.save()
 
+        # Reconstrói apenas o que mudou se a equipe já estiver em cache
         cache_key = self._get_cache_key(user_id, instance_id)
-        if cache_key in self.teams_cache:
-            del self.teams_cache[cache_key]
+        previous_team = self.teams_cache.get(cache_key)
+        if previous_team is not None:
+            self._build_team(
+                instance,
+                previous_team=previous_team,
+                previous_members=self.members_cache.get(cache_key)
+            )
         
         return True
 
@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+from pymongo.errors import DuplicateKeyError
+from app.models.analytics import InstanceDailyStats, InstanceDailySession
+
+logger = logging.getLogger(__name__)
+
+# Mantém referência às gravações em segundo plano até terminarem
+_pending: Set[asyncio.Task] = set()
+
+
+def _day_bucket(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _sum_metric(value: Any) -> int:
+    # O agno registra uma entrada por chamada de modelo na execução
+    if isinstance(value, (list, tuple)):
+        return int(sum(v for v in value if isinstance(v, (int, float))))
+    if isinstance(value, (int, float)):
+        return int(value)
+    return 0
+
+
+def _collect_tokens(response: Any) -> Dict[str, int]:
+    """Soma os tokens do coordenador e, recursivamente, dos membros.
+
+    No modo "coordinate" as métricas do TeamRunResponse cobrem só as chamadas
+    do coordenador; as dos especialistas ficam em member_responses.
+    """
+    metrics: Dict[str, Any] = getattr(response, "metrics", None) or {}
+    totals = {
+        key: _sum_metric(metrics.get(key))
+        for key in ("input_tokens", "output_tokens", "total_tokens")
+    }
+    for member_response in getattr(response, "member_responses", None) or []:
+        for key, value in _collect_tokens(member_response).items():
+            totals[key] += value
+    return totals
+
+
+async def record_chat(
+    user_id: str,
+    instance_id: str,
+    session_id: str,
+    response: Any,
+    latency_ms: float
+) -> None:
+    """Incrementa o documento do dia com uma única operação atômica (upsert).
+
+    A sessão só soma em active_sessions na primeira mensagem do dia, quando o
+    marcador em InstanceDailySession é inserido sem conflito.
+    """
+    now = datetime.utcnow()
+    day = _day_bucket(now)
+    tokens = _collect_tokens(response)
+
+    try:
+        await InstanceDailySession.get_motor_collection().insert_one({
+            "user_id": user_id,
+            "instance_id": instance_id,
+            "day": day,
+            "session_hash": hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+        })
+        new_session = 1
+    except DuplicateKeyError:
+        new_session = 0
+
+    await InstanceDailyStats.get_motor_collection().update_one(
+        {"user_id": user_id, "instance_id": instance_id, "day": day},
+        {
+            "$inc": {
+                "message_count": 1,
+                "active_sessions": new_session,
+                "input_tokens": tokens["input_tokens"],
+                "output_tokens": tokens["output_tokens"],
+                "total_tokens": tokens["total_tokens"],
+                "latency_ms_total": latency_ms,
+            },
+            "$set": {"updated_at": now},
+        },
+        upsert=True
+    )
+
+
+def schedule_record_chat(
+    user_id: str,
+    instance_id: str,
+    session_id: str,
+    response: Any,
+    latency_ms: float
+) -> None:
+    """Grava as estatísticas em segundo plano, sem atrasar a resposta ao cliente."""
+    task = asyncio.create_task(record_chat(user_id, instance_id, session_id, response, latency_ms))
+    _pending.add(task)
+    task.add_done_callback(_on_record_done)
+
+
+def _on_record_done(task: asyncio.Task) -> None:
+    _pending.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Falha ao gravar estatísticas do chat", exc_info=task.exception())
+
+
+async def get_instance_stats(
+    user_id: str,
+    instance_id: Optional[str] = None,
+    days: int = 7
+) -> List[Dict[str, Any]]:
+    """Lê os documentos diários já agregados, sem tocar no histórico de conversas."""
+    match: Dict[str, Any] = {
+        "user_id": user_id,
+        "day": {"$gte": _day_bucket(datetime.utcnow()) - timedelta(days=days - 1)}
+    }
+    if instance_id:
+        match["instance_id"] = instance_id
+
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"instance_id": 1, "day": 1}},
+        {"$project": {
+            "_id": 0,
+            "instance_id": 1,
+            "day": 1,
+            "message_count": 1,
+            "active_sessions": 1,
+            "input_tokens": 1,
+            "output_tokens": 1,
+            "total_tokens": 1,
+            "avg_latency_ms": {
+                "$cond": [
+                    {"$gt": ["$message_count", 0]},
+                    {"$divide": ["$latency_ms_total", "$message_count"]},
+                    0
+                ]
+            }
+        }}
+    ]
+    return await InstanceDailyStats.get_motor_collection().aggregate(pipeline).to_list(length=None)
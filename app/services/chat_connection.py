@@ -0,0 +1,199 @@
+import asyncio
+import functools
+import json
+import os
+import time
+import uuid
+from typing import Dict, Optional, Any, Set
+from fastapi import WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+from app.models.chat_frame import ChatFrame
+from app.services.agent_manager import agent_manager
+from app.services.run_control import run_team, run_metrics, RunCancelled
+from app.services.analytics import schedule_record_chat
+
+HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", 20))
+HEARTBEAT_MISSES = int(os.getenv("WS_HEARTBEAT_MISSES", 3))
+MAX_INFLIGHT = int(os.getenv("WS_MAX_INFLIGHT", 16))
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", 64))
+
+TEAM_NOT_CONFIGURED = (
+    "A equipe de agentes ainda não foi configurada. "
+    "Por favor, use o painel de configuração para definir os agentes e, "
+    "em seguida, clique em 'Criar/Atualizar Equipe'."
+)
+
+
+class ChatConnection:
+    """Multiplexa várias sessões de chat sobre um único WebSocket.
+
+    Mensagens de sessões diferentes rodam em paralelo, cada sessão na sua
+    própria equipe (AgentManager.get_session_team); dentro de uma mesma
+    sessão são processadas na ordem de chegada.
+
+    Quadros de controle (ping, cancel) são lidos sempre. A fila de saída é
+    limitada: um cliente que lê devagar bloqueia as execuções, que seguram
+    suas vagas, e mensagens novas acima de WS_MAX_INFLIGHT recebem um erro
+    "busy" em vez de serem enfileiradas (backpressure).
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: Optional[str], instance_id: Optional[str]):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.instance_id = instance_id
+
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.inflight: Dict[str, asyncio.Task] = {}
+        # Ids cujas execuções já entraram em run_team
+        self.reached_run: Set[str] = set()
+        self.last_seen = asyncio.get_running_loop().time()
+        self.disconnected = False
+
+    async def serve(self) -> None:
+        tasks = [
+            asyncio.create_task(self._reader()),
+            asyncio.create_task(self._writer()),
+            asyncio.create_task(self._heartbeat()),
+        ]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Execuções canceladas daqui em diante contam como desconexão
+            self.disconnected = True
+            pending = [*tasks, *self.inflight.values()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            try:
+                await self.websocket.close()
+            except RuntimeError:
+                # Conexão já encerrada pelo cliente
+                pass
+
+    async def _send(self, payload: Dict[str, Any]) -> None:
+        await self.outbox.put(json.dumps(payload, ensure_ascii=False, default=str))
+
+    def _reply(self, payload: Dict[str, Any]) -> None:
+        """Resposta do leitor: nunca bloqueia a leitura de quadros.
+
+        Com a fila cheia o cliente não está lendo, então a resposta é descartada.
+        """
+        try:
+            self.outbox.put_nowait(json.dumps(payload, ensure_ascii=False, default=str))
+        except asyncio.QueueFull:
+            pass
+
+    async def _writer(self) -> None:
+        while True:
+            text = await self.outbox.get()
+            await self.websocket.send_text(text)
+
+    async def _heartbeat(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            if loop.time() - self.last_seen > HEARTBEAT_INTERVAL * HEARTBEAT_MISSES:
+                return
+            await self._send({"type": "ping"})
+
+    async def _reader(self) -> None:
+        try:
+            while True:
+                raw = await self.websocket.receive_text()
+                self.last_seen = asyncio.get_running_loop().time()
+                self._dispatch(raw)
+        except WebSocketDisconnect:
+            self.disconnected = True
+            print(f"Cliente desconectado: {self.user_id}-{self.instance_id}")
+
+    async def _is_disconnected(self) -> bool:
+        return self.disconnected
+
+    def _dispatch(self, raw: str) -> None:
+        try:
+            frame = ChatFrame.model_validate_json(raw)
+        except ValidationError as e:
+            self._reply({"type": "error", "detail": f"Quadro inválido: {e.errors()}"})
+            return
+
+        if frame.type == "ping":
+            self._reply({"type": "pong", "id": frame.id})
+        elif frame.type == "cancel":
+            task = self.inflight.get(frame.id) if frame.id else None
+            if task is None:
+                self._reply({"type": "error", "id": frame.id, "detail": "Nenhuma execução em andamento com este id"})
+                return
+            task.cancel()
+            self._reply({"type": "cancelled", "id": frame.id})
+        elif frame.type == "message":
+            self._start_run(frame)
+
+    def _start_run(self, frame: ChatFrame) -> None:
+        frame.id = frame.id or str(uuid.uuid4())
+        frame.user_id = frame.user_id or self.user_id
+        frame.instance_id = frame.instance_id or self.instance_id
+
+        if not frame.user_id or not frame.instance_id or not frame.message:
+            self._reply({"type": "error", "id": frame.id, "detail": "user_id, instance_id e message são obrigatórios"})
+            return
+        if frame.id in self.inflight:
+            self._reply({"type": "error", "id": frame.id, "detail": "Já existe uma execução em andamento com este id"})
+            return
+
+        frame.session_id = frame.session_id or f"{frame.user_id}-{frame.instance_id}-playground"
+
+        if len(self.inflight) >= MAX_INFLIGHT:
+            self._reply({"type": "error", "id": frame.id, "code": "busy", "detail": "Limite de execuções simultâneas atingido"})
+            return
+
+        task = asyncio.create_task(self._run(frame))
+        task.add_done_callback(functools.partial(self._on_run_done, frame.id))
+        self.inflight[frame.id] = task
+
+    def _on_run_done(self, frame_id: str, task: asyncio.Task) -> None:
+        # Execuções canceladas antes de chegar a run_team (que conta as
+        # próprias) são contadas aqui; incluem tasks que nem começaram.
+        if task.cancelled() and frame_id not in self.reached_run:
+            run_metrics.increment("cancelled_disconnect" if self.disconnected else "cancelled_client")
+        self.reached_run.discard(frame_id)
+
+    async def _run(self, frame: ChatFrame) -> None:
+        try:
+            team = await agent_manager.get_session_team(frame.user_id, frame.instance_id, frame.session_id)
+            if not team.members:
+                await self._send({"type": "error", "id": frame.id, "session_id": frame.session_id, "detail": TEAM_NOT_CONFIGURED})
+                return
+
+            started = time.monotonic()
+            self.reached_run.add(frame.id)
+            response = await run_team(
+                team,
+                frame.message,
+                session_id=frame.session_id,
+                lock=agent_manager.session_lock(frame.user_id, frame.instance_id, frame.session_id),
+                timeout=frame.timeout,
+                is_disconnected=self._is_disconnected
+            )
+            schedule_record_chat(
+                frame.user_id,
+                frame.instance_id,
+                frame.session_id,
+                response,
+                (time.monotonic() - started) * 1000
+            )
+            await self._send({
+                "type": "response",
+                "id": frame.id,
+                "session_id": frame.session_id,
+                "content": response.content
+            })
+        except RunCancelled as e:
+            # Em caso de desconexão não há mais para quem responder
+            if e.reason == "deadline":
+                await self._send({"type": "error", "id": frame.id, "session_id": frame.session_id, "detail": "Tempo limite da requisição excedido"})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._send({"type": "error", "id": frame.id, "session_id": frame.session_id, "detail": f"Ocorreu um erro: {e}"})
+        finally:
+            self.inflight.pop(frame.id, None)
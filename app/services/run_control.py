@@ -0,0 +1,94 @@
+import asyncio
+from collections import defaultdict
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, Optional
+from agno.team import Team
+
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+class RunMetrics:
+    """Contadores em memória do resultado das execuções de equipes."""
+
+    def __init__(self):
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    def increment(self, name: str) -> None:
+        self.counters[name] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(self.counters)
+
+
+run_metrics = RunMetrics()
+
+
+class RunCancelled(Exception):
+    """A execução foi abandonada antes de terminar.
+
+    `reason` é "deadline" (prazo excedido) ou "disconnect" (cliente desconectou).
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+async def _wait_for_disconnect(is_disconnected: Callable[[], Awaitable[bool]]) -> None:
+    while not await is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+async def run_team(
+    team: Team,
+    message: str,
+    session_id: str,
+    lock: AsyncContextManager[Any],
+    timeout: Optional[float] = None,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+) -> Any:
+    """Executa a equipe respeitando prazo e desconexão do cliente.
+
+    `lock` serializa as execuções que compartilham a mesma equipe (ver
+    AgentManager.session_lock); a espera por ele conta dentro do prazo.
+
+    O cancelamento é cooperativo: a task de `team.arun` é cancelada, o que
+    interrompe as chamadas assíncronas de modelo e ferramentas em andamento e
+    evita a gravação da sessão no storage ao final da execução.
+    """
+    async def locked_run() -> Any:
+        async with lock:
+            return await team.arun(message, session_id=session_id)
+
+    run = asyncio.create_task(locked_run())
+    watchers = []
+    if is_disconnected is not None:
+        watchers.append(asyncio.create_task(_wait_for_disconnect(is_disconnected)))
+
+    try:
+        done, _ = await asyncio.wait(
+            {run, *watchers},
+            timeout=timeout,
+            return_when=asyncio.FIRST_COMPLETED
+        )
+    except asyncio.CancelledError:
+        # Cancelado por quem chamou: pelo cliente (quadro "cancel") ou porque a
+        # conexão caiu, o que `is_disconnected` permite distinguir.
+        disconnected = is_disconnected is not None and await is_disconnected()
+        run_metrics.increment("cancelled_disconnect" if disconnected else "cancelled_client")
+        raise
+    finally:
+        for task in (run, *watchers):
+            if not task.done():
+                task.cancel()
+
+    if run not in done:
+        reason = "disconnect" if done else "deadline"
+        run_metrics.increment(f"cancelled_{reason}")
+        raise RunCancelled(reason)
+
+    if run.exception() is not None:
+        run_metrics.increment("failed")
+        raise run.exception()
+
+    run_metrics.increment("completed")
+    return run.result()